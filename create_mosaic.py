@@ -2,7 +2,15 @@ from PIL import Image
 import argparse
 import pathlib
 import sys
-from photomosaic import img_to_squares, patch_image_from_files, find_color_neighbor
+from photomosaic import (
+    img_to_squares,
+    img_to_quadtree,
+    quadtree_square_size,
+    patch_image_from_files,
+    patch_image_from_regions,
+    find_color_neighbor,
+    find_nearest_color,
+)
 import json
 from tqdm import tqdm
 
@@ -39,6 +47,31 @@ def main():
     )
     # option to to specify the size of the pixels to generate in the pixelated image
     parser.add_argument("-s", "--size", help="Size of the pixels", default=50, type=int)
+    # adaptive mode: split the squares further only where the image has detail
+    parser.add_argument(
+        "-a",
+        "--adaptive",
+        help="Use squares of varying size, --size is the largest square size"
+        + " (rounded down to --min-size times a power of two). Detailed areas"
+        + " are split down to --min-size, so this can use more thumbnails than"
+        + " the fixed grid with the same --size",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-m",
+        "--min-size",
+        help="Smallest square size in adaptive mode. Default: 10",
+        default=10,
+        type=int,
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        help="Color standard deviation above which squares are split in adaptive"
+        + " mode. Default: 20",
+        default=20.0,
+        type=float,
+    )
 
     args = parser.parse_args()
 
@@ -74,6 +107,10 @@ def main():
     im = Image.open(im_name)
     print(im.format, im.size, im.mode)
 
+    if args.adaptive:
+        create_adaptive_mosaic(im, path, folder, cache_dict, args)
+        return
+
     # split the image into squares
     squares = img_to_squares(im, size)
 
@@ -105,5 +142,56 @@ def main():
     mosaic_im.save(mosaic_name)
 
 
+def create_adaptive_mosaic(
+    im: Image.Image,
+    path: pathlib.Path,
+    folder: pathlib.Path,
+    cache_dict: dict,
+    args: argparse.Namespace,
+):
+    """Create a photomosaic with squares of varying size and save it."""
+    min_size = args.min_size
+    try:
+        size = quadtree_square_size(args.size, min_size)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    if size != args.size:
+        print(f"Square size {args.size} rounded down to {size}")
+    regions = img_to_quadtree(im, size, min_size, args.threshold)
+    if not regions:
+        print(f"Image is smaller than the square size: {size}")
+        sys.exit(1)
+
+    # retrieve nearest thumbnail for the average color of each square
+    print(f"Collecting thumbnails and finding nearest color matches from {folder}")
+    thumb_regions = []
+    for box, RGB_avg in tqdm(regions):
+        neighbor = find_nearest_color(RGB_avg, cache_dict)
+        thumb_path = pathlib.Path(f"{folder}/{neighbor}")
+        if not thumb_path.exists():
+            print(f"Thumbnail does not exit in image cache: {thumb_path}")
+            sys.exit(1)
+        thumb_regions.append((box, thumb_path))
+
+    print(f"Thumbnails collected: {len(thumb_regions)}")
+
+    # the largest squares are shown with about the full thumbnail size, smaller
+    # squares with downscaled thumbnails. Round the scale so the smallest
+    # squares are a whole number of pixels (at least one), then all squares
+    # are, as they are multiples of the smallest one.
+    with Image.open(thumb_regions[0][1]) as thumb_im:
+        min_tile = max(round(thumb_im.size[0] * min_size / size), 1)
+    scale = min_tile / min_size
+
+    # generate new image from thumbnails
+    mosaic_im = patch_image_from_regions(thumb_regions, scale)
+
+    # save new image
+    mosaic_name = f"output/{path.stem}_mosaic_{size}_{min_size}{path.suffix}"
+    print(f"Saving new image: {mosaic_name}")
+    mosaic_im.save(mosaic_name)
+
+
 if __name__ == "__main__":
     main()
@@ -1,10 +1,14 @@
 from photomosaic.utils import (
     img_to_squares,
+    img_to_quadtree,
+    quadtree_square_size,
     generate_avg_color_image,
     patch_image_from_files,
+    patch_image_from_regions,
     pixelate,
     create_thumbnail,
     avg_color,
     find_color_neighbor,
+    find_nearest_color,
     pixelate_gif,
 )
@@ -1,4 +1,6 @@
-from PIL import Image, ImageOps
+from PIL import Image, ImageMath, ImageOps
+from itertools import accumulate
+from operator import add
 import pathlib
 import math
 import random
@@ -30,6 +32,137 @@ def img_to_squares(im: Image.Image, sq_size=50):
     return squares
 
 
+def summed_area_tables(im: Image.Image, cell_size=1) -> list[list[list[int]]]:
+    """Calculate summed-area tables of the input image, sampled on a grid of
+    cell_size x cell_size cells. Returns four tables: the sums of the R, G
+    and B values and the sum of the squares of all three channels.
+
+    Entry [r][c] of each table holds the sum over all pixels above and to the
+    left of pixel (c * cell_size, r * cell_size). Partial cells on the right
+    and bottom are cut off, same as in img_to_squares."""
+    im = im.convert("RGB")
+    cols = im.size[0] // cell_size
+    rows = im.size[1] // cell_size
+    im = im.crop((0, 0, cols * cell_size, rows * cell_size))
+    r, g, b = (im.getchannel(band).convert("F") for band in range(3))
+    squares = ImageMath.lambda_eval(
+        lambda args: args["r"] * args["r"]
+        + args["g"] * args["g"]
+        + args["b"] * args["b"],
+        r=r,
+        g=g,
+        b=b,
+    )
+
+    # let Pillow average the pixels of each cell, so only the cells have to be
+    # summed up in Python
+    pixels = cell_size**2
+    tables = []
+    for band in (r, g, b, squares):
+        cell_avgs = list(band.reduce(cell_size).getdata())
+        table = [[0] * (cols + 1)]
+        for y in range(rows):
+            row = [round(v * pixels) for v in cell_avgs[y * cols : (y + 1) * cols]]
+            table.append(list(map(add, table[-1], accumulate(row, initial=0))))
+        tables.append(table)
+
+    return tables
+
+
+def region_stats(
+    tables: list[list[list[int]]], box: tuple[int, int, int, int], cell_size=1
+) -> tuple[tuple[int, int, int], float]:
+    """Calculate the average color (RGB tuple) and the color variance of a region
+    of an image in constant time from its summed-area tables.
+
+    The box is given as (left, top, right, bottom) in cells of the tables.
+    The variance is the mean squared distance of the pixels from the average
+    color, i.e. the square of the standard deviation in RGB space."""
+    left, top, right, bottom = box
+    sums = [
+        t[bottom][right] - t[top][right] - t[bottom][left] + t[top][left]
+        for t in tables
+    ]
+    pixels = (right - left) * (bottom - top) * cell_size**2
+    means = [s / pixels for s in sums[:3]]
+    # clamp rounding errors of the subtraction for flat regions
+    variance = max(sums[3] / pixels - sum(m**2 for m in means), 0.0)
+
+    return tuple(int(m) for m in means), variance
+
+
+def quadtree_square_size(sq_size: int, min_size: int) -> int:
+    """Return the largest square size for img_to_quadtree that is not larger
+    than sq_size and is min_size times a power of two,
+    e.g. 50 and 10 -> 40."""
+    if min_size < 1:
+        raise ValueError(f"Minimum square size {min_size} has to be at least 1")
+    if sq_size < min_size:
+        raise ValueError(
+            f"Square size {sq_size} is smaller than minimum square size {min_size}"
+        )
+    cells = 1
+    while cells * 2 * min_size <= sq_size:
+        cells *= 2
+
+    return cells * min_size
+
+
+def img_to_quadtree(
+    im: Image.Image, sq_size=50, min_size=10, threshold=20.0
+) -> list[tuple[tuple[int, int, int, int], tuple[int, int, int]]]:
+    """Divide the input image into squares of varying size. The image is cut
+    into squares of sq_size first, then each square is split into four
+    quarters as long as the standard deviation of its colors is above
+    threshold and the quarters are not smaller than min_size.
+
+    sq_size has to be min_size times a power of two so all squares stay
+    square, quadtree_square_size rounds any other size down to one.
+    Returns a list of (box, RGB average) tuples, with the boxes given in
+    pixels as (left, top, right, bottom)."""
+    cells = sq_size // min_size if min_size >= 1 else 0
+    if cells < 1 or sq_size % min_size or cells & (cells - 1):
+        raise ValueError(
+            f"Square size {sq_size} is not a power of two multiple of {min_size}"
+        )
+    width, height = im.size
+    row_squares = height // sq_size
+    col_squares = width // sq_size
+
+    # summed-area tables only need to cover the squares, with one entry per
+    # smallest possible square
+    tables = summed_area_tables(
+        im.crop((0, 0, col_squares * sq_size, row_squares * sq_size)), min_size
+    )
+
+    def split(left, top, size):
+        RGB_avg, variance = region_stats(
+            tables, (left, top, left + size, top + size), min_size
+        )
+        # small tolerance so flat squares are not split with a threshold of 0
+        if size == 1 or variance <= threshold**2 + 1e-6:
+            box = tuple(v * min_size for v in (left, top, left + size, top + size))
+            return [(box, RGB_avg)]
+        half = size // 2
+        regions = []
+        for dy in (0, half):
+            for dx in (0, half):
+                regions.extend(split(left + dx, top + dy, half))
+        return regions
+
+    regions = []
+    for r in range(row_squares):
+        for c in range(col_squares):
+            regions.extend(split(c * cells, r * cells, cells))
+    print(
+        f"Image has {len(regions)} squares of size {min_size} to {sq_size}"
+        + f" instead of {col_squares * row_squares * cells**2} of size {min_size}"
+        + f" or {col_squares * row_squares} of size {sq_size}"
+    )
+
+    return regions
+
+
 def generate_color_block(
     width: int, height: int, color: tuple[int, int, int]
 ) -> Image.Image:
@@ -133,6 +266,33 @@ def patch_image_from_files(squares: list[list[str]]) -> Image.Image:
     return im
 
 
+def patch_image_from_regions(
+    regions: list[tuple[tuple[int, int, int, int], str]], scale: float
+) -> Image.Image:
+    """Generate a new image from the provided list of (box, filename) tuples,
+    e.g. from img_to_quadtree. Each image is loaded from the file, resized to
+    its box multiplied by scale and pasted into the box."""
+    width = round(max(box[2] for box, _ in regions) * scale)
+    height = round(max(box[3] for box, _ in regions) * scale)
+
+    # create new image
+    im = Image.new("RGB", (width, height))
+    print(f"New image dimensions: {im.size}")
+    # patch the image together, only loading and resizing each file once
+    # for each size it is used in
+    print("Patching new image together from squares")
+    tiles = {}
+    for box, sq in regions:
+        left, top, right, bottom = (round(v * scale) for v in box)
+        size = (right - left, bottom - top)
+        if (sq, size) not in tiles:
+            with Image.open(sq) as tmp_im:
+                tiles[(sq, size)] = tmp_im.resize(size)
+        im.paste(tiles[(sq, size)], (left, top))
+
+    return im
+
+
 def pixelate(im: Image.Image, size: int) -> Image.Image:
     """Convenience function: cut an image into squares of size and
     generate a new image with average color of the squares. Return
@@ -257,7 +417,12 @@ def color_distance(a_RGB: tuple[int, int, int], b_RGB: tuple[int, int, int]) ->
 def find_color_neighbor(im: Image.Image, cache_dict: dict) -> str:
     """Find the nearest image from the image cache that is close to the average
     RGB of the provided image."""
-    src_avg_RGB = avg_color(im)
+    return find_nearest_color(avg_color(im), cache_dict)
+
+
+def find_nearest_color(src_avg_RGB: tuple[int, int, int], cache_dict: dict) -> str:
+    """Find the nearest image from the image cache that is close to the provided
+    average RGB."""
     # TODO: find a smarter way of searching through the cache
     min_dist = 1_000
     # set a default random image from the cache in case nothing is found